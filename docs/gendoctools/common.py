@@ -19,15 +19,31 @@ Siconos is a program dedicated to modeling, simulation and control
  See the License for the specific language governing permissions and
  limitations under the License.
 """
-import shutil
+import concurrent.futures
+import functools
+import itertools
+import os
+import re
 import pickle
 import textwrap
 from pathlib import Path
 
-try:
-    import lxml.etree as ET
-except ImportError:
-    import xml.etree.ElementTree as ET
+_UPPER_RE = re.compile(r'[A-Z]')
+
+# 'KEY = value' line in doxygen config
+_DOXY_KV_RE = re.compile(rb'^([A-Z0-9_]+)\s*\+?=\s*(.*)$')
+
+# Escape backslashes in latex forms
+_ESCAPE = str.maketrans({'\\': '\\\\'})
+
+# $...$ latex formula
+_MATH_RE = re.compile(r'\$([^$]+)\$')
+
+# Names of xml files found in a directory, keyed by (path, mtime).
+_DIR_CACHE = {}
+
+# Latex forms read from pickle files, keyed by (file name, mtime).
+_PICKLE_CACHE = {}
 
 
 def get_xml_files(header_name, xml_path, case_sense_names=True):
@@ -60,14 +76,29 @@ def get_xml_files(header_name, xml_path, case_sense_names=True):
     fnwe = fnwe.replace('_', '__')
     if not case_sense_names:
         fnwe = replace_uppercase_letters(fnwe)
-    # Look for 'class' files
-    classfiles = [f for f in xml_path.glob('class' + fnwe + '.xml')]
-    # Look for 'struct' files
-    structfiles = [f for f in xml_path.glob('struct' + fnwe + '.xml')]
-    # Look for '8h' (?) files
-    files8h = [f for f in xml_path.glob(fnwe + '_8h*.xml')]
-    allfiles = classfiles + structfiles + files8h
-    return allfiles
+    xml_names = _list_xml_files(xml_path)
+    classname = 'class' + fnwe + '.xml'
+    structname = 'struct' + fnwe + '.xml'
+    prefix = fnwe + '_8h'
+    names = itertools.chain(
+        # Look for 'class' and 'struct' files
+        (n for n in (classname, structname) if n in xml_names),
+        # Look for '8h' (?) files
+        sorted(n for n in xml_names if n.startswith(prefix)))
+    return [xml_path / name for name in names]
+
+
+def _list_xml_files(xml_path):
+    """Returns the names of all xml files in xml_path.
+
+    The directory is scanned only once, as long as it is not modified.
+    """
+    key = (xml_path, xml_path.stat().st_mtime_ns)
+    names = _DIR_CACHE.get(key)
+    if names is None:
+        names = {p.name for p in xml_path.iterdir() if p.suffix == '.xml'}
+        _DIR_CACHE[key] = names
+    return names
 
 
 def parse_doxygen_config(filename):
@@ -80,19 +111,22 @@ def parse_doxygen_config(filename):
 
     Returns a python dictionnary
     """
-    result = {}
-    with open(filename) as ff:
-        # remove comment lines
-        conf = [n.strip() for n in ff.readlines()
-                if (not n.startswith('#') and not n.startswith('\n'))]
-        for d in conf:
-            if d.count('=') > 0:
-                res = d.split('=')
-                result[res[0].rsplit()[0]] = res[1]
-                backup = res.copy()
-            else:
-                result[backup[0].rsplit()[0]] += d
-    return result
+    slots = {}
+    values = None
+    with open(filename, 'rb') as ff:
+        lines = ff.read().split(b'\n')
+    for line in lines:
+        # remove comment and empty lines
+        line = line.strip()
+        if not line or line.startswith(b'#'):
+            continue
+        match = _DOXY_KV_RE.match(line)
+        if match:
+            values = slots[match.group(1).decode()] = [match.group(2)]
+        elif values is not None:
+            # continuation of the previous value
+            values.append(line)
+    return {key: b''.join(v).decode() for key, v in slots.items()}
 
 
 def filter_dot_in_xml_formulas(xmlfile):
@@ -108,15 +142,30 @@ def filter_dot_in_xml_formulas(xmlfile):
     xmlfile: Path()
         xml file name (full path) (in-out param)
     """
-    fileout = xmlfile.stem + '.tmp'
-    with open(xmlfile, 'r+', encoding='utf8') as f:
-        lines = f.read()
-    newlines = lines.replace(r'\\dot', r'\dot')
-    with open(fileout, 'w', encoding='utf8') as f:
-        f.write(newlines)
-    shutil.move(fileout, xmlfile)
+    xmlfile = Path(xmlfile)
+    data = xmlfile.read_bytes()
+    if rb'\\dot' in data:
+        xmlfile.write_bytes(data.replace(rb'\\dot', rb'\dot'))
+
+
+def filter_dot_in_xml_dir(xml_path):
+    r"""Replace \\dot with \dot in all xml files of a directory.
+
+    Same as filter_dot_in_xml_formulas, for all files at once.
+    Only files which contain \\dot are rewritten.
+
+    Parameters
+    ----------
+    xml_path: Path()
+        directory of xml files (in-out param)
+    """
+    with os.scandir(xml_path) as entries:
+        for entry in entries:
+            if entry.name.endswith('.xml') and entry.is_file():
+                filter_dot_in_xml_formulas(Path(entry.path))
 
 
+@functools.lru_cache(maxsize=4096)
 def replace_uppercase_letters(filename):
     """Replace uppercase letters in a string
     with _lowercase (following doxygen way)
@@ -131,14 +180,7 @@ def replace_uppercase_letters(filename):
 
     result = replace_uppercase_letters(input)
     """
-    r = []
-    for c in filename:
-        # l being: last character was not uppercase
-        newc = c
-        if c.isupper():
-            newc = '_' + c.lower()
-        r.append(newc)
-    return ''.join(r)
+    return _UPPER_RE.sub(lambda m: '_' + m.group(0).lower(), filename)
 
 
 def get_xml_compound_infos(compound):
@@ -147,30 +189,20 @@ def get_xml_compound_infos(compound):
     from an xml node (compound)
     """
     kind = compound.attrib['kind']
-    names = compound.findall('compoundname')
-    descr = compound.findall('briefdescription')
-    assert len(names) == 1
-    assert len(descr) == 1
-    #res = ''
-    content = descr[0].find('para')
+    name = compound.find('compoundname')
+    descr = compound.find('briefdescription')
+    assert name is not None
+    assert descr is not None
+    content = descr.find('para')
     if content is not None:
-        res = ET.tostring(content, method='text')
-        # for child in descr[0]:
-        #     try:
-        #         res += child.text
-        #     except:
-        #         pass
-        #     for sub in child:
-        #         try :
-        #             res += sub.text
-        #         except:
-        #             pass
+        # text of para and of all its children
+        res = ''.join(content.itertext())
         # new lines in description must be indented
-        res = '\n    '.join(res.decode().split('\n'))
+        res = res.replace('\n', '\n    ')
         res = find_and_replace_math(res)
     else:
         res = ''
-    return names[0].text, kind, res
+    return name.text, kind, res
 
 
 def find_and_replace_math(content):
@@ -179,13 +211,32 @@ def find_and_replace_math(content):
 
     content : a string.
     """
-    if content.count('$') > 1:
-        start = content.find('$')
-        end = content.find('$', start + 1)
-        doxy_latex = content[start: end + 1]
-        rst_latex = r':math:`' + doxy_latex[1:-1].strip() + r'`'
-        content = content.replace(doxy_latex, rst_latex)
-    return content
+    return _MATH_RE.sub(lambda m: ':math:`' + m.group(1).strip() + '`',
+                        content)
+
+
+def _load_latex(fname):
+    """Returns the dictionnary of latex forms saved in a pickle file.
+
+    Results are cached and reused as long as the file is not modified.
+
+    Parameters
+    ----------
+    fname : Path()
+       pickle file (result of do_latex or do_verbatim call in sicodoxy2swig)
+    """
+    key = (str(fname), fname.stat().st_mtime_ns)
+    latex_dict = _PICKLE_CACHE.get(key)
+    if latex_dict is None:
+        with open(fname, 'rb') as f:
+            latex_dict = pickle.load(f)
+        _PICKLE_CACHE[key] = latex_dict
+    return latex_dict
+
+
+def _forms_pattern(forms):
+    """Returns a regex matching any of the formulas ids in forms."""
+    return re.compile('|'.join(re.escape(idf) for idf in forms))
 
 
 def replace_latex(inoutfile, latex_sources):
@@ -194,8 +245,8 @@ def replace_latex(inoutfile, latex_sources):
     Parameters
     ----------
 
-    inoutfile : Path()
-       name (full path) of the python file to process
+    inoutfile : Path() or list of Path()
+       name (full path) of the python file(s) to process
     latex_sources : string or Path()
        directory which contains pickle files with latex forms
        (result of do_latex or do_verbatim call in sicodoxy2swig)
@@ -203,6 +254,8 @@ def replace_latex(inoutfile, latex_sources):
     Usually : inoutfile = some_component.py (e.g. numerics.py)
     and latex_dir = wrap/siconos/tmp_component_name.
 
+    When several files are given, they are processed in parallel.
+
     This function is supposed to be called by a target
     generated with cmake (make <component>_replace_latex)
 
@@ -217,45 +270,89 @@ def replace_latex(inoutfile, latex_sources):
     #runner = os.path.join(os.path.dirname(os.path.abspath(__file__)),
     #                      'replace_latex.sh')
 
-    # temp file for outputs.
-    inoutfile = Path(inoutfile)
-    target = Path(inoutfile.parent, inoutfile.stem + '.copy').resolve()
-    shutil.copyfile(inoutfile, target)
-    # Read input (.py)
-    with open(inoutfile, "r") as f:
-        source_lines = f.readlines()
-    rst = []
-    # Parse and replace :
-    # for each formula found in each pickle file,
-    # replace FORMULA_Id with the proper string
-    # in temp list.
+    # Collect all formulas found in pickle files :
+    # FORMULA<Id>_ --> (formula type, formula),
+    # the first definition of an id wins.
+    all_forms = {}
     for fname in formfiles:
-        with open(fname, 'rb') as f:
-            latex_dict = pickle.load(f)
-            for form in latex_dict:
-                idf = 'FORMULA' + str(form) + '_'
-                # we must \\dot in \rst doxygen
-                # else there is a confusion with dot from graphviz.
-                formula = latex_dict[form]["latex"].replace(r'\\', '\\\\')
-                # escape \
-                formula = latex_dict[form]["latex"].replace('\\', '\\\\')
-                formula_type = latex_dict[form]["label"]  # inline or not
-                #formula = ''.join(formula)
-                for line in source_lines:
-                    if formula_type == 'inline':
-                        rst.append(line.replace(idf, formula))
-                    else:
-                        indent = len(line) - len(line.lstrip())
-                        rst.append(
-                            line.replace(idf, textwrap.indent(formula,
-                                                              indent * ' ')))
-                source_lines = list(rst)
-                rst = []
-
-    # Replace .py with new results.
-    with open(target, 'w') as f:
-        for line in source_lines:
-            f.write(line)
-    shutil.move(target, inoutfile)
+        latex_dict = _load_latex(fname)
+        for form in latex_dict:
+            idf = 'FORMULA' + str(form) + '_'
+            if idf in all_forms:
+                continue
+            # we must \\dot in \rst doxygen
+            # else there is a confusion with dot from graphviz.
+            # escape \
+            formula = latex_dict[form]["latex"].translate(_ESCAPE)
+            all_forms[idf] = (latex_dict[form]["label"], formula)
+    # then split between inline and other forms.
+    inline_forms = {}
+    block_forms = {}
+    for idf, (formula_type, formula) in all_forms.items():
+        if formula_type == 'inline':
+            inline_forms[idf] = formula
+        else:
+            block_forms[idf] = formula
+
+    if isinstance(inoutfile, (str, Path)):
+        inoutfiles = [inoutfile]
+    else:
+        inoutfiles = list(inoutfile)
+    process = functools.partial(_process_file, inline_forms=inline_forms,
+                                block_forms=block_forms)
+    if len(inoutfiles) > 1:
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            list(executor.map(process, inoutfiles))
+    else:
+        for f in inoutfiles:
+            process(f)
+
 
+def _process_file(inoutfile, inline_forms, block_forms):
+    """Replace latex forms ids in a python file (see replace_latex).
+
+    Parameters
+    ----------
 
+    inoutfile : Path()
+       name (full path) of the python file to process
+    inline_forms, block_forms : dict
+       FORMULA<Id>_ --> formula, for inline and other formulas.
+    """
+    # Line transforms: each FORMULA<Id>_ found is replaced
+    # with the proper string, with one regex for each kind of formula.
+    substitutions = []
+    if inline_forms:
+        pattern = _forms_pattern(inline_forms)
+        substitutions.append(functools.partial(
+            pattern.sub, lambda m: inline_forms[m.group(0)]))
+    if block_forms:
+        pattern = _forms_pattern(block_forms)
+        # indented formulas, keyed by (id, indent width)
+        indented = {}
+
+        def _replace(match):
+            # non-inline formulas are indented as the current line
+            line = match.string
+            key = (match.group(0), len(line) - len(line.lstrip()))
+            formula = indented.get(key)
+            if formula is None:
+                formula = textwrap.indent(block_forms[key[0]], key[1] * ' ')
+                indented[key] = formula
+            return formula
+
+        substitutions.append(functools.partial(pattern.sub, _replace))
+
+    # Stream input (.py) into a temp file, line by line,
+    # and replace .py with new results.
+    inoutfile = Path(inoutfile)
+    target = Path(inoutfile.parent, inoutfile.stem + '.copy')
+    with open(inoutfile, 'r', encoding='utf8', buffering=1 << 20) as fin, \
+         open(target, 'w', encoding='utf8', buffering=1 << 20) as fout:
+        for line in fin:
+            # most lines have no formula: no need to run regexes on them
+            if 'FORMULA' in line:
+                for substitute in substitutions:
+                    line = substitute(line)
+            fout.write(line)
+    os.replace(target, inoutfile)
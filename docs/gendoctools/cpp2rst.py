@@ -36,10 +36,13 @@ import buildtools as bt
 from pathlib import Path
 from gendoctools import common
 
-try:
-    import lxml.etree as ET
-except ImportError:
-    import xml.etree.ElementTree as ET
+import lxml.etree as ET
+
+# Options of libxml2 parser used for doxygen xml outputs :
+# no table of ids, no limit on the size of (huge) files.
+# Note : remove_blank_text is not used since it drops spaces
+# between tags in descriptions (e.g. '<bold>a</bold> <bold>b</bold>').
+_XML_PARSER_OPTIONS = {'collect_ids': False, 'huge_tree': True}
 
 components_docs = {
     'externals' : 'API or tools related to external software libraries used by Siconos.',
@@ -100,6 +103,8 @@ def create_breathe_files(headers, srcdir, component_name,
     # Get xml files path
     xmlconf['XML_OUTPUT'] = Path(xml_output)
     all_index = {}
+    # Replace \\dot in latex formulas of all xml files
+    common.filter_dot_in_xml_dir(xmlconf['XML_OUTPUT'])
     # -- Create rst for classes, structs and files found in xml directory --
     for hfile in headers:
         xml2rst(Path(hfile), srcdir, component_name, sphinx_directory,
@@ -157,15 +162,22 @@ def xml2rst(headername, srcdir, component_name, sphinx_directory,
     # Then, for each xml, write sphinx header.
     # 3 cases : class, struct or file.
     for f in xml_files:
-        common.filter_dot_in_xml_formulas(f)
         path = os.path.join(xml_path, f)
-        root = ET.parse(path).getroot()
         f = f.as_posix()
-        compounds = root.findall('compounddef')
+        # Stream compounds : infos are read from the first one,
+        # the others are only counted.
+        ncompounds = 0
+        for _, compound in ET.iterparse(path, events=('end',),
+                                        tag='compounddef',
+                                        **_XML_PARSER_OPTIONS):
+            if ncompounds == 0:
+                name, kind, descr = common.get_xml_compound_infos(compound)
+            ncompounds += 1
+            compound.clear()
+        assert ncompounds > 0
         refname = sphinxref4headername(headername.as_posix(), srcdir)
-        name, kind, descr = common.get_xml_compound_infos(compounds[0])
         if f.find('class') > -1 or f.find('struct') > -1:
-            assert len(compounds) == 1
+            assert ncompounds == 1
             all_index[name] = descr
             assert kind in ('struct', 'class')
             label = '.. _' + kind + '_' + name + ':\n\n'